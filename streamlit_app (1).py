@@ -1,73 +1,346 @@
 # streamlit_app.py - Enhanced UI for AutoMeta
 
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import os
+import re
+import platform
+import hashlib
+import atexit
+import shutil
+import subprocess
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, TemporaryDirectory, mkdtemp
 import json
 import yaml
 
-from transformers import pipeline
-from keybert import KeyBERT
+import torch
+from transformers import AutoTokenizer, pipeline
+from sentence_transformers import SentenceTransformer, util
+from sklearn.feature_extraction.text import CountVectorizer
 import fitz  # PyMuPDF
-import docx
-import pytesseract
+from lxml import etree
 from pdf2image import convert_from_path
+from PIL import Image, ImageOps
 
-# Load Models
+try:
+    import ctranslate2
+except ImportError:
+    ctranslate2 = None
+
+# Summarization models, fastest first
+SUMMARIZER_MODELS = [
+    "sshleifer/distilbart-cnn-6-6",
+    "sshleifer/distilbart-cnn-12-6",
+    "facebook/bart-large-cnn",
+]
+DEFAULT_SUMMARIZER = "sshleifer/distilbart-cnn-12-6"
+
+# Optional CTranslate2 conversions, one sub-directory per model, e.g.
+#   ct2-transformers-converter --model sshleifer/distilbart-cnn-12-6 --quantization int8 --output_dir ct2_models/distilbart-cnn-12-6
+CT2_MODEL_DIR = Path(os.environ.get("AUTOMETA_CT2_DIR", "ct2_models"))
+
+KEYWORD_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+def keyword_model_onnx_file():
+    # Pick the quantized ONNX export the model repo ships for this CPU, else the plain FP32 export
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "onnx/model_qint8_arm64.onnx"
+    cpu_flags = set()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    cpu_flags = set(line.split(":", 1)[1].split())
+                    break
+    except OSError:
+        pass
+    if "avx512_vnni" in cpu_flags:
+        return "onnx/model_qint8_avx512_vnni.onnx"
+    if "avx2" in cpu_flags:
+        return "onnx/model_quint8_avx2.onnx"
+    return "onnx/model.onnx"
+
+class CT2Summarizer:
+    """Drop-in for the summarization pipeline backed by a CTranslate2 model (cached decoder states, int8 matmuls)."""
+
+    def __init__(self, model_dir, model_name):
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        compute_type = "int8_float16" if device == "cuda" else "int8"
+        self.translator = ctranslate2.Translator(str(model_dir), device=device, compute_type=compute_type)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    def __call__(self, texts, max_length=80, min_length=20, num_beams=2, no_repeat_ngram_size=0, batch_size=0, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        sources = [
+            self.tokenizer.convert_ids_to_tokens(self.tokenizer.encode(t, truncation=True))
+            for t in texts
+        ]
+        results = self.translator.translate_batch(
+            sources,
+            beam_size=num_beams,
+            max_decoding_length=max_length,
+            min_decoding_length=min_length,
+            no_repeat_ngram_size=no_repeat_ngram_size,
+            max_batch_size=batch_size
+        )
+        return [
+            {"summary_text": self.tokenizer.decode(
+                self.tokenizer.convert_tokens_to_ids(r.hypotheses[0]), skip_special_tokens=True
+            )}
+            for r in results
+        ]
+
+# Pipelines aren't thread-safe; every summarizer call (warm-up included) holds this lock.
+# Cached so all reruns and sessions share one lock rather than a fresh script global each run.
+@st.cache_resource
+def summarizer_lock():
+    return threading.Lock()
+
+def warm_up(summarizer, lock):
+    with lock:
+        summarizer("warmup text " * 50, max_length=30, min_length=5, **GENERATION_KWARGS)
+
+# Load Summarizer (cached separately for each model)
 @st.cache_resource
-def load_models():
-    summarizer = pipeline("summarization", model="facebook/bart-large-cnn")
-    kw_model = KeyBERT("sentence-transformers/all-MiniLM-L6-v2")
-    return summarizer, kw_model
+def load_summarizer(model_name=DEFAULT_SUMMARIZER):
+    ct2_dir = CT2_MODEL_DIR / model_name.split("/")[-1]
+    if ctranslate2 is not None and ct2_dir.is_dir():
+        summarizer = CT2Summarizer(ct2_dir, model_name)
+    elif torch.cuda.is_available():
+        # Half precision on GPU runs on tensor cores at half the memory traffic
+        summarizer = pipeline("summarization", model=model_name, device=0, torch_dtype=torch.float16)
+    else:
+        # Dynamic int8 quantization of the Linear layers for CPU inference
+        summarizer = pipeline("summarization", model=model_name, device=-1)
+        summarizer.model = torch.ao.quantization.quantize_dynamic(
+            summarizer.model, {torch.nn.Linear}, dtype=torch.qint8
+        )
 
-summarizer, kw_model = load_models()
+    # Warm up in the background so the first real request doesn't pay the one-off setup cost
+    threading.Thread(target=warm_up, args=(summarizer, summarizer_lock()), daemon=True).start()
+    return summarizer
+
+# Keyword embedder, shared by every summarizer model
+@st.cache_resource
+def load_keyword_model():
+    if torch.cuda.is_available():
+        return SentenceTransformer(KEYWORD_MODEL)
+    return SentenceTransformer(
+        KEYWORD_MODEL, backend="onnx", model_kwargs={"file_name": keyword_model_onnx_file()}
+    )
 
 # Extract Text Functions
+
+WORD_RE = re.compile(r"\S+")
+
+def count_words(text):
+    # Same count as len(text.split()) without building the list of words
+    return sum(1 for _ in WORD_RE.finditer(text))
+
+# A PDF whose first few pages all have less text than this is treated as a scan and sent straight to OCR
+PDF_PROBE_PAGES = 3
+MIN_PDF_PROBE_CHARS = 20
+
 def extract_text_from_pdf(path):
-    doc = fitz.open(path)
-    return "\n".join(page.get_text() for page in doc).strip()
+    # Count words page by page so the joined text never has to be re-split
+    pages, word_count = [], 0
+    with fitz.open(path) as doc:
+        probe = (doc[i].get_text("text").strip() for i in range(min(PDF_PROBE_PAGES, len(doc))))
+        if not any(len(t) >= MIN_PDF_PROBE_CHARS for t in probe):
+            return "", 0
+        for page in doc:
+            page_text = page.get_text("text")
+            pages.append(page_text)
+            word_count += count_words(page_text)
+    return "\n".join(pages).strip(), word_count
+
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# Run-level break elements and the whitespace python-docx renders them as
+WORD_BREAKS = {f"{WORD_NS}tab": "\t", f"{WORD_NS}br": "\n", f"{WORD_NS}cr": "\n"}
+
+def docx_paragraph_text(paragraph):
+    # Only direct runs (and runs inside hyperlinks) are read, so text boxes and their
+    # mc:Fallback copies nested in drawings are skipped like in python-docx
+    parts = []
+    for child in paragraph.iterchildren(f"{WORD_NS}r", f"{WORD_NS}hyperlink"):
+        runs = child.iterchildren(f"{WORD_NS}r") if child.tag == f"{WORD_NS}hyperlink" else (child,)
+        for run in runs:
+            for item in run.iterchildren():
+                if item.tag == f"{WORD_NS}t":
+                    parts.append(item.text or "")
+                elif item.tag in WORD_BREAKS:
+                    parts.append(WORD_BREAKS[item.tag])
+    return "".join(parts)
 
 def extract_text_from_docx(path):
-    doc = docx.Document(path)
-    return "\n".join(p.text for p in doc.paragraphs).strip()
+    # Read the body's paragraphs straight from document.xml instead of building python-docx objects
+    parser = etree.XMLParser(resolve_entities=False, no_network=True)
+    with zipfile.ZipFile(path) as z:
+        root = etree.fromstring(z.read("word/document.xml"), parser)
+    body = root.find(f"{WORD_NS}body")
+    return "\n".join(
+        docx_paragraph_text(p) for p in body.iterchildren(f"{WORD_NS}p")
+    ).strip()
+
+# LSTM engine with a single uniform text block; skips Tesseract's page layout analysis
+OCR_CONFIG = ["--oem", "1", "--psm", "6"]
+# One OpenMP thread per tesseract process, since pages are already OCR'd in parallel.
+# Passed only to the tesseract child so the server's own runtimes (torch, CTranslate2) keep every core.
+TESSERACT_ENV = {**os.environ, "OMP_THREAD_LIMIT": "1"}
+
+def ocr_page(image_path, threshold=128):
+    # Stretch contrast and binarize in place so Tesseract gets a clean black-on-white page
+    with Image.open(image_path) as img:
+        page = ImageOps.autocontrast(img).point(lambda p: 255 if p > threshold else 0)
+    page.save(image_path)
+    result = subprocess.run(
+        ["tesseract", image_path, "stdout", *OCR_CONFIG],
+        env=TESSERACT_ENV, capture_output=True, check=True, text=True, encoding="utf-8"
+    )
+    return result.stdout
 
 def extract_text_via_ocr(path):
-    images = convert_from_path(path)
-    return "\n".join(pytesseract.image_to_string(img) for img in images).strip()
+    # Rasterize pages in parallel to disk instead of holding every page in RAM
+    with TemporaryDirectory() as tmpdir:
+        image_paths = convert_from_path(
+            path,
+            dpi=200,
+            grayscale=True,
+            thread_count=max(1, (os.cpu_count() or 1) - 1),
+            output_folder=tmpdir,
+            fmt="png",
+            paths_only=True
+        )
+        # Pages are preprocessed and OCR'd per worker; each tesseract run is its own process,
+        # so threads are enough to use every core
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+            texts = list(ex.map(ocr_page, image_paths))
+        return "\n".join(texts).strip()
+
+# Private (0700) directory for uploads, removed when the server exits
+@st.cache_resource
+def upload_dir():
+    path = Path(mkdtemp(prefix="autometa-"))
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+# File Processing (cached on the SHA-256 of the upload, so reruns skip re-extraction)
+@st.cache_data(show_spinner=False)
+def process_file(file_hash, ext, _file_bytes):
+    # One file per distinct upload; written under a temporary name and renamed so it is never seen half-written
+    tmp_path = upload_dir() / f"{file_hash}{ext}"
+    if not tmp_path.exists():
+        with NamedTemporaryFile(dir=tmp_path.parent, delete=False) as part:
+            part.write(_file_bytes)
+        os.replace(part.name, tmp_path)
+
+    text, doc_type, word_count = "", "Unknown", None
+
+    if ext == ".pdf":
+        text, word_count = extract_text_from_pdf(tmp_path)
+        if not text:
+            text, word_count = extract_text_via_ocr(tmp_path), None
+            doc_type = "Scanned PDF"
+        else:
+            doc_type = "PDF"
+
+    elif ext == ".docx":
+        text = extract_text_from_docx(tmp_path)
+        doc_type = "DOCX"
+
+    elif ext == ".txt":
+        text = tmp_path.read_text(encoding="utf-8")
+        doc_type = "TXT"
+
+    return text, doc_type, word_count
 
 # Chunking-based Summarization
 
-def summarize_long_text(text, chunk_size=1000, max_chunks=5):
-    chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
-    summaries = []
-    for chunk in chunks[:max_chunks]:
-        result = summarizer(chunk, max_length=130, min_length=30, do_sample=False)
-        summaries.append(result[0]['summary_text'])
-    return " ".join(summaries)
+# Narrow beam search that stops as soon as the beams finish; enough for metadata-length output
+GENERATION_KWARGS = dict(num_beams=2, early_stopping=True, no_repeat_ngram_size=3, do_sample=False)
 
-# Metadata Generator
-def generate_metadata(text, doc_type="Unknown"):
-    # Generate summary
-    summary = summarize_long_text(text)
-    
-    # Generate title (via summarizer)
-    title_prompt = "Generate a title for the following document: " + text[:1000]
-    title_result = summarizer(title_prompt, max_length=15, min_length=4, do_sample=False)
-    title = title_result[0]["summary_text"].strip().upper()
-    
-    keywords = kw_model.extract_keywords(
-        text,
-        keyphrase_ngram_range=(1, 2),
-        stop_words='english',
-        top_n=8
+def summarize_long_text(summarizer, text, chunk_size=1000, max_chunks=5):
+    chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)][:max_chunks]
+    if not chunks:
+        return ""
+    # One batched call so the model runs all chunks in a single forward pass
+    results = summarizer(
+        chunks,
+        max_length=80,
+        min_length=20,
+        batch_size=len(chunks),
+        truncation=True,
+        **GENERATION_KWARGS
     )
+    return " ".join(r['summary_text'] for r in results)
+
+# Keyword Extraction
+
+KEYWORD_KWARGS = dict(ngram_range=(1, 2), stop_words='english')
+# The leading text gives near-identical top keywords at a fraction of the embedding work
+KEYWORD_TEXT_CHARS = 4096
+
+# Keywords depend only on the text, so they survive summarizer model changes
+@st.cache_data(show_spinner=False)
+def extract_keywords(text, top_n=8):
+    text = text[:KEYWORD_TEXT_CHARS]
+    try:
+        candidates = CountVectorizer(**KEYWORD_KWARGS).fit([text]).get_feature_names_out().tolist()
+    except ValueError:
+        # Nothing but stop words
+        return []
+
+    # Embeddings stay on the embedder's device and are scored with one similarity matmul
+    embedder = load_keyword_model()
+    doc_embedding = embedder.encode([text], convert_to_tensor=True)
+    candidate_embeddings = embedder.encode(candidates, convert_to_tensor=True, batch_size=512)
+    scores = util.cos_sim(doc_embedding, candidate_embeddings)[0]
+    top = torch.topk(scores, k=min(top_n, len(candidates))).indices
+    return [candidates[i] for i in top.tolist()]
+
+# Metadata Generator
+
+# Below this many words the text is its own summary; running BART on it only wastes a decode
+SHORT_TEXT_WORDS = 80
+
+# Cached per (text, document type, summarizer model) so widget reruns don't re-run the models
+@st.cache_data(show_spinner=False)
+def generate_metadata(text, doc_type="Unknown", model_name=DEFAULT_SUMMARIZER, word_count=None):
+    if word_count is None:
+        word_count = count_words(text)
+    summarizer = load_summarizer(model_name)
+
+    # Embed keywords on a worker thread while the summarizer decodes
+    with ThreadPoolExecutor(max_workers=1, initializer=add_script_run_ctx, initargs=(None, get_script_run_ctx())) as executor:
+        keywords_future = executor.submit(extract_keywords, text)
+
+        if word_count < SHORT_TEXT_WORDS:
+            # Fast path: first sentence as title, leading text as summary
+            title = text.strip().split(".")[0][:120].strip().upper()
+            summary = text.strip()[:400]
+        else:
+            with summarizer_lock():
+                # Generate summary
+                summary = summarize_long_text(summarizer, text)
+
+                # Generate title (via summarizer)
+                title_prompt = "Generate a title for the following document: " + text[:1000]
+                title_result = summarizer(title_prompt, max_length=15, min_length=4, **GENERATION_KWARGS)
+                title = title_result[0]["summary_text"].strip().upper()
+
+        keywords = keywords_future.result()
+
     return {
         "TITLE": title,
         "SUMMARY": summary,
-        "KEYWORDS": [kw[0] for kw in keywords],
+        "KEYWORDS": keywords,
         "DOCUMENT_TYPE": doc_type,
-        "WORD_COUNT": len(text.split())
+        "WORD_COUNT": word_count
     }
 
 # UI Layout
@@ -80,35 +353,27 @@ with st.container():
         <hr style='margin-top:0;'>
     """, unsafe_allow_html=True)
 
+model_name = st.sidebar.selectbox(
+    "Summarization Model",
+    SUMMARIZER_MODELS,
+    index=SUMMARIZER_MODELS.index(DEFAULT_SUMMARIZER),
+    help="DistilBART 6-6 is fastest; BART-large-CNN is the most accurate but slowest."
+)
+# Load up front so the spinner shows on model selection rather than on the first upload
+load_summarizer(model_name)
+load_keyword_model()
+
 uploaded = st.file_uploader(" Upload Document", type=["pdf", "docx", "txt"], help="Supported formats: PDF, DOCX, TXT")
 
 if uploaded:
-    with NamedTemporaryFile(delete=False, suffix=Path(uploaded.name).suffix) as tmp_file:
-        tmp_file.write(uploaded.read())
-        tmp_path = tmp_file.name
-
+    file_bytes = uploaded.getvalue()
+    file_hash = hashlib.sha256(file_bytes).hexdigest()
     ext = Path(uploaded.name).suffix.lower()
-    text, doc_type = "", "Unknown"
-
-    if ext == ".pdf":
-        text = extract_text_from_pdf(tmp_path)
-        if not text:
-            text = extract_text_via_ocr(tmp_path)
-            doc_type = "Scanned PDF"
-        else:
-            doc_type = "PDF"
-
-    elif ext == ".docx":
-        text = extract_text_from_docx(tmp_path)
-        doc_type = "DOCX"
-
-    elif ext == ".txt":
-        text = Path(tmp_path).read_text(encoding="utf-8")
-        doc_type = "TXT"
+    text, doc_type, word_count = process_file(file_hash, ext, file_bytes)
 
     if text:
         st.success(" Document processed successfully.")
-        metadata = generate_metadata(text, doc_type)
+        metadata = generate_metadata(text, doc_type, model_name, word_count)
 
         col1, col2 = st.columns(2)
 